@@ -1,17 +1,33 @@
 import asyncio
-import json
 import re
-from json import JSONDecodeError
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
 from typing import AsyncGenerator
+from typing import Callable
 from typing import TypedDict
 
+import lxml.html
+import orjson
+from aiohttp import AsyncResolver
 from aiohttp import ClientSession
-from bs4 import BeautifulSoup
-from bs4 import PageElement
-from bs4.element import NavigableString
-from bs4.element import Tag
+from aiohttp import TCPConnector
+from lxml import etree
+from lxml.html import HtmlElement
 from yarl import URL
 
+_REQUIRED_MAP: dict[str, bool] = {"yes": True, "no": False}
+# Strips "..." placeholders and trailing commas, and adds the commas missing before some properties.
+_CLEAN_JSON_RE = re.compile(
+    r',(?:\.\.\.)*(?=[\]}])'
+    r'|\.\.\.'
+    r'|(?:(?<=[^,{\s.])|(?<=[^,{\s]\.\.\.))"(?P<name>data|click_action)"(?=:)'
+)
+_MAIN_XPATH = etree.XPath('//body//div[contains(concat(" ", normalize-space(@class), " "), " main ")]')
+_LEFT_DOCS_XPATH = etree.XPath('./section[contains(@class, "left-docs")]')
+_RIGHT_CODE_XPATH = etree.XPath('./section[contains(@class, "right-code")]')
+_JSON_BLOCK_XPATH = etree.XPath('.//div[contains(@class, "language-json")]')
+_HTML_PARSER = lxml.html.HTMLParser(remove_blank_text=True, remove_comments=True)
+
 
 class HttpField(TypedDict, total=False):
     key: str
@@ -31,30 +47,32 @@ class EndpointDoc(TypedDict, total=False):
     request_body: list[HttpField]
     response_body: list[HttpField]
     query_params: list[HttpField]
-    example_response: dict
+    example_response: orjson.Fragment
+    example_response_raw: bytes  # Spliced into the output as `example_response` without being reparsed.
+
+
+def get_text(element: HtmlElement, separator: str = "") -> str:
+    return separator.join(text for text in (raw.strip() for raw in element.itertext()) if text)
 
 
-def pull_scopes(tag: Tag) -> list[str]:
+def pull_scopes(element: HtmlElement) -> list[str]:
     scopes: list[str] = []
 
-    for scope_tag in tag.find_all("strong"):
-        scopes.append(scope_tag.get_text(strip=True, separator=" ").casefold())
+    for scope_element in element.iterdescendants("strong"):
+        scopes.append(get_text(scope_element, " ").casefold())
 
     return scopes
 
 
-def pull_possible_values_list(tag: Tag) -> list[str]:
-    values_list_tag = tag.find("ul")
+def pull_possible_values_list(element: HtmlElement) -> list[str]:
+    values_list_element = element.find(".//ul")
     container: list[str] = []
 
-    if values_list_tag is None:
+    if values_list_element is None:
         return []
 
-    for child in values_list_tag.children:
-        if not isinstance(child, Tag):
-            continue
-
-        value_text = child.get_text(separator=" ", strip=True)
+    for item in values_list_element.iterchildren("li"):
+        value_text = get_text(item, " ")
 
         if "\u2014" in value_text:
             container.append(value_text.split(" \u2014 ")[0])
@@ -66,53 +84,33 @@ def pull_possible_values_list(tag: Tag) -> list[str]:
     return container
 
 
-def parse_request_body(tag: Tag) -> list[HttpField]:
+def parse_request_body(element: HtmlElement) -> list[HttpField]:
     # noinspection PyTypeChecker
     container: list[HttpField] = []
-    body_tag = tag.find("tbody")
-
-    for row in body_tag.children:
-        if isinstance(row, NavigableString):
-            continue
-
-        row: Tag
+    body_element = element.find(".//tbody")
 
-        table_data = [child for child in row.children if isinstance(child, Tag)]
-        field: HttpField = {
-            "key": table_data[0].get_text(strip=True, separator=" "),
-            "type": table_data[1].get_text(strip=True, separator=" ").casefold()
-        }
+    for row in body_element.iterchildren("tr"):
+        table_data: list[HtmlElement] = row.findall("td")
+        raw_description = table_data[-1]
+        data_type = get_text(table_data[1], " ").casefold()
+        description = get_text(raw_description, " ")
+        field: HttpField = {"key": get_text(table_data[0], " "), "type": data_type, "description": description}
 
         if len(table_data) == 4:  # We have a "required" column
-            bool_text = table_data[2].get_text(strip=True).casefold()
-            field["description"] = table_data[3].get_text(strip=True, separator=" ")
-            raw_description = table_data[3]
-
-            match bool_text:
-                case "yes":
-                    field["required"] = True
-                case "no":
-                    field["required"] = False
+            required = _REQUIRED_MAP.get(get_text(table_data[2]).casefold())
+
+            if required is not None:
+                field["required"] = required
         else:
             field["required"] = False
-            field["description"] = table_data[2].get_text(strip=True, separator=" ")
-            raw_description = table_data[2]
 
-        if "Possible values" in field["description"] and field["type"] == "string".casefold():
+        if data_type == "string" and "Possible values" in description:
             field["possible_values"] = pull_possible_values_list(raw_description)
 
-        if "The default is" in field["description"]:
-            try:
-                index = field["description"].index("The default is")
-            except ValueError:
-                pass
-            else:
-                field["default_value"] = field["description"][index + len("the default is") + 1:].split(" ")[0]
-
-                if field["default_value"].startswith('"'):
-                    field["default_value"] = field["default_value"][1:-1]
+        _, separator, tail = description.partition("The default is ")
 
-                field["default_value"] = field["default_value"].rstrip(".,")
+        if separator:
+            field["default_value"] = tail.split(" ", 1)[0].rstrip(".,").strip('"')
 
         container.append(field)
 
@@ -120,151 +118,194 @@ def parse_request_body(tag: Tag) -> list[HttpField]:
 
 
 # noinspection PyTypeChecker
-def parse_response_body(tag: Tag) -> list[HttpField]:
+def parse_response_body(element: HtmlElement) -> list[HttpField]:
     container: list[HttpField] = []
-    body_tag = tag.find("tbody")
+    body_element = element.find(".//tbody")
     key_format_string: str | None = None
 
-    for row in body_tag.children:
-        if isinstance(row, NavigableString):
-            continue
-
-        row: Tag
-
-        data: list[Tag] = [child for child in row.children if isinstance(child, Tag)]
-        key = data[0].get_text(strip=True, separator=" ")
-        data_type = data[1].get_text(strip=True, separator=" ")
-        description = data[2].get_text(strip=True, separator=" ")
+    for row in body_element.iterchildren("tr"):
+        data: list[HtmlElement] = row.findall("td")
+        key = get_text(data[0], " ")
+        data_type = get_text(data[1], " ")
+        description = get_text(data[2], " ")
 
         field: HttpField = {"key": (key if key_format_string is None else key_format_string.format(key)).casefold(),
                             "type": data_type.casefold(), "description": description, }
 
         container.append(field)
 
-        if field["key"].casefold().endswith("[]".casefold()):  # We're in an array.
+        if field["key"].endswith("[]"):  # We're in an array.
             key_format_string = f"{key}[#]." + "{0}"
-        elif field["key"].casefold().startswith("Object".casefold()):
+        elif field["key"].startswith("object"):
             key_format_string = f"{key}." + "{0}"
 
     return container
 
 
-def scrape_doc_left_column(tag: Tag) -> EndpointDoc:
+def _handle_scopes(element: HtmlElement, endpoint_doc: EndpointDoc) -> None:
+    endpoint_doc["scopes"] = pull_scopes(element)
+
+
+def _handle_url(element: HtmlElement, endpoint_doc: EndpointDoc) -> None:
+    segments = get_text(element, " ").split(" ")
+
+    if len(segments) == 2:
+        http_method = segments[0]
+        url = segments[1]
+    else:
+        http_method = "GET"
+        url = segments[0]
+
+    endpoint_doc["method"] = http_method
+    endpoint_doc["url"] = url
+
+
+def _handle_request_body(element: HtmlElement, endpoint_doc: EndpointDoc) -> None:
+    endpoint_doc["request_body"] = parse_request_body(element)
+
+
+def _handle_query_params(element: HtmlElement, endpoint_doc: EndpointDoc) -> None:
+    endpoint_doc["query_params"] = parse_request_body(element)
+
+
+def _handle_response_body(element: HtmlElement, endpoint_doc: EndpointDoc) -> None:
+    endpoint_doc["response_body"] = parse_response_body(element)
+
+
+# Keyed by (tag name, current h3 header).
+_LEFT_COLUMN_HANDLERS: dict[tuple[str, str], Callable[[HtmlElement, EndpointDoc], None]] = {
+    ("p", "Authorization"): _handle_scopes,
+    ("p", "URL"): _handle_url,
+    ("table", "Request Body"): _handle_request_body,
+    ("table", "Request Query Parameters"): _handle_query_params,
+    ("table", "Response Body"): _handle_response_body,
+}
+
+
+def scrape_doc_left_column(element: HtmlElement) -> EndpointDoc:
     endpoint_doc: EndpointDoc = {}
     current_header: str | None = None
+    title: str | None = None
+    summary_parts: list[str] = []
+
+    for child in element.iterchildren(etree.Element):
+        tag = child.tag
+
+        if tag == "h2" and child.get("id"):
+            title = endpoint_doc["title"] = get_text(child, " ")
+            current_header = title
+        elif tag == "h3":
+            current_header = get_text(child, " ")
+        elif tag == "p" and title is not None and current_header == title:
+            paragraph = get_text(child, " ")
+
+            if paragraph:
+                summary_parts.append(paragraph)
+        else:
+            handler = _LEFT_COLUMN_HANDLERS.get((tag, current_header))
 
-    for child in tag.children:
-        child: Tag
-
-        if child.name == "h2" and child.attrs.get("id", None):
-            endpoint_doc["title"] = child.get_text(strip=True, separator=" ")
-            current_header = endpoint_doc["title"]
-        elif child.name == "p" and current_header == endpoint_doc["title"]:
-            if not endpoint_doc.get("summary", None):
-                endpoint_doc["summary"] = ""
-
-            endpoint_doc["summary"] = endpoint_doc["summary"] + "\n\n" + child.get_text(strip=True, separator=" ")
-            endpoint_doc["summary"] = endpoint_doc["summary"].strip()
-        elif child.name == "h3":
-            current_header = child.get_text(strip=True, separator=" ")
-        elif child.name == "p" and current_header == "Authorization":
-            endpoint_doc["scopes"] = pull_scopes(child)
-        elif child.name == "p" and current_header == "URL":
-            segments = child.get_text(strip=True, separator=" ").split(" ")
-
-            if len(segments) == 2:
-                http_method = segments[0]
-                url = segments[1]
-            else:
-                http_method = "GET"
-                url = segments[0]
-
-            endpoint_doc["method"] = http_method
-            endpoint_doc["url"] = url
-        elif child.name == "table" and current_header == "Request Body":
-            endpoint_doc["request_body"] = parse_request_body(child)
-        elif child.name == "table" and current_header == "Request Query Parameters":
-            endpoint_doc["query_params"] = parse_request_body(child)
-        elif child.name == "table" and current_header == "Response Body":
-            endpoint_doc["response_body"] = parse_response_body(child)
+            if handler is not None:
+                handler(child, endpoint_doc)
+
+    if summary_parts:
+        endpoint_doc["summary"] = "\n\n".join(summary_parts)
 
     return endpoint_doc
 
 
-def fix_json_property(json_string: str, property_name: str) -> str:
-    string_copy = json_string
-    index: int = 0
+def _clean_json_match(match: re.Match[str]) -> str:
+    name = match.group("name")
 
-    while True:
-        try:
-            index = string_copy[index:].index(F'"{property_name}"')
-        except ValueError:
-            return string_copy
+    return "" if name is None else f',"{name}"'
 
-        if string_copy[index - 1] not in [",", "{"]:
-            string_copy = string_copy[:index] + "," + string_copy[index:]
-        else:
-            return string_copy
 
-
-def scrape_doc_section(tag: PageElement) -> EndpointDoc:
-    left_doc_column = tag.find_next("section", attrs={"class": "left-docs"})
+def scrape_doc_section(element: HtmlElement) -> EndpointDoc:
+    left_doc_column = next(iter(_LEFT_DOCS_XPATH(element)), None)
 
     left_doc_scrape_result: EndpointDoc | None = None
     if left_doc_column is not None:
         left_doc_scrape_result = scrape_doc_left_column(left_doc_column)
 
-    right_doc_column = tag.find_next("section", attrs={"class": "right-code"})
-    right_response_column = right_doc_column.find("div", attrs={"class": "language-json"})
+    right_doc_column = _RIGHT_CODE_XPATH(element)[0]
+    right_response_column = next(iter(_JSON_BLOCK_XPATH(right_doc_column)), None)
 
     if right_response_column is not None:
-        right_column_text = right_response_column.get_text(strip=True)
-        right_column_text = right_column_text.replace("...", "")
-        right_column_text = right_column_text.replace(",]", "]")
-        right_column_text = right_column_text.replace(",}", "}")
-        right_column_text = fix_json_property(right_column_text, "data")
-        right_column_text = fix_json_property(right_column_text, "click_action")
+        right_column_text = get_text(right_response_column)
+        right_column_text = _CLEAN_JSON_RE.sub(_clean_json_match, right_column_text)
+        right_column_raw = right_column_text.encode()
 
         try:
-            left_doc_scrape_result["example_response"] = json.loads(right_column_text)
-        except JSONDecodeError as e:
+            orjson.loads(right_column_raw)
+        except orjson.JSONDecodeError as e:
             print("ERR", right_column_text[e.colno- 1:])
             print(right_column_text)
 
+            return left_doc_scrape_result
+
+        left_doc_scrape_result["example_response_raw"] = right_column_raw
+
     return left_doc_scrape_result
 
 
-async def scrape_docs(url: URL) -> AsyncGenerator[EndpointDoc, None]:
-    async with ClientSession() as session:
-        async with session.get(url) as response:
-            if not response.ok:
-                return
+def scrape_doc_section_html(html: str) -> EndpointDoc:
+    return scrape_doc_section(lxml.html.fragment_fromstring(html, parser=_HTML_PARSER))
 
-            soup = BeautifulSoup(await response.text(), "lxml")
-            doc_section = soup.find("body").find("div", attrs={"class": "main"})
 
-            at_endpoint_definition_table = True
-            for child in doc_section.children:
-                child: Tag
+def split_doc_sections(html: str) -> list[str]:
+    tree = lxml.html.fromstring(html, parser=_HTML_PARSER)
+    doc_section = _MAIN_XPATH(tree)[0]
+    sections: list[str] = []
+    children = doc_section.iterchildren("section")
 
-                if at_endpoint_definition_table or child.name is None or child.name.casefold() != "section".casefold():
-                    at_endpoint_definition_table = False
+    # The first section is the endpoint definition table, which isn't an endpoint.
+    next(children, None)
 
-                    continue
+    for section in children:
+        sections.append(lxml.html.tostring(section, encoding="unicode", with_tail=False))
+
+    return sections
 
-                yield scrape_doc_section(child)
+
+async def scrape_docs(url: URL, session: ClientSession, executor: Executor) -> AsyncGenerator[EndpointDoc, None]:
+    async with session.get(url) as response:
+        if not response.ok:
+            return
+
+        text = await response.text()
+
+    loop = asyncio.get_running_loop()
+    sections = await loop.run_in_executor(executor, split_doc_sections, text)
+    futures = [loop.run_in_executor(executor, scrape_doc_section_html, section) for section in sections]
+
+    for future in futures:
+        yield await future
 
 
 async def main():
-    endpoints: list[EndpointDoc] = []
-    async for result in scrape_docs(URL("https://dev.twitch.tv/docs/api/reference")):
-        if not result:
-            continue
+    connector = TCPConnector(resolver=AsyncResolver(), limit=32, ttl_dns_cache=600, keepalive_timeout=30)
+
+    async with ClientSession(connector=connector, headers={"Accept-Encoding": "gzip"}) as session:
+        with ProcessPoolExecutor() as executor, open("endpoints.json", "wb") as file:
+            file.write(b"[")
+            first = True
+
+            async for result in scrape_docs(URL("https://dev.twitch.tv/docs/api/reference"), session, executor):
+                if not result:
+                    continue
+
+                if not first:
+                    file.write(b",")
+
+                example_response = result.pop("example_response_raw", None)
+
+                if example_response is not None:
+                    result["example_response"] = orjson.Fragment(example_response)
 
-        endpoints.append(result)
+                file.write(b"\n")
+                file.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+                first = False
 
-    with open("endpoints.json", "w") as file:
-        json.dump(endpoints, file, indent=2)
+            file.write(b"\n]\n")
 
 
 if __name__ == '__main__':